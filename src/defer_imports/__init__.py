@@ -11,9 +11,18 @@ import contextvars
 import importlib.util
 import sys
 import zipimport
-from collections import deque
-from importlib.machinery import BYTECODE_SUFFIXES, SOURCE_SUFFIXES, FileFinder, ModuleSpec, PathFinder, SourceFileLoader
-from itertools import islice, takewhile
+from importlib.machinery import (
+    BYTECODE_SUFFIXES,
+    EXTENSION_SUFFIXES,
+    SOURCE_SUFFIXES,
+    ExtensionFileLoader,
+    FileFinder,
+    ModuleSpec,
+    PathFinder,
+    SourceFileLoader,
+    SourcelessFileLoader,
+)
+from itertools import takewhile
 from threading import RLock
 
 
@@ -45,10 +54,12 @@ def _lazy_import_module(name: str, package: typing.Optional[str] = None) -> type
     Based on importlib code as well as recipes found in the Python 3.12 importlib docs.
     """
 
+    modules = sys.modules
+
     # 1. Resolve the name.
     absolute_name = importlib.util.resolve_name(name, package)
-    if absolute_name in sys.modules:
-        return sys.modules[absolute_name]
+    if absolute_name in modules:
+        return modules[absolute_name]
 
     # 2. Find the module's parent if it exists.
     path = None
@@ -78,13 +89,13 @@ def _lazy_import_module(name: str, package: typing.Optional[str] = None) -> type
     # 5. Execute and return the module
     # 5.1. Account for the module replacing itself in sys.modules.
     module = importlib.util.module_from_spec(spec)
-    sys.modules[absolute_name] = module
+    modules[absolute_name] = module
     loader.exec_module(module)
 
     if path is not None:
-        setattr(parent_module, child_name, sys.modules[absolute_name])  # pyright: ignore [reportPossiblyUnboundVariable]
+        setattr(parent_module, child_name, modules[absolute_name])  # pyright: ignore [reportPossiblyUnboundVariable]
 
-    return sys.modules[absolute_name]
+    return modules[absolute_name]
 
 
 if TYPE_CHECKING:
@@ -194,31 +205,6 @@ else:  # pragma: <3.12 cover
 # ============================================================================
 
 
-def _sliding_window(
-    iterable: coll_abc.Iterable[tokenize.TokenInfo],
-    n: int,
-) -> coll_abc.Generator[tuple[tokenize.TokenInfo, ...]]:
-    """Collect tokens into overlapping fixed-length chunks or blocks.
-
-    Notes
-    -----
-    Slightly modified version of the sliding_window recipe found in the Python 3.12 itertools docs.
-
-    Examples
-    --------
-    >>> source = "def func(): ..."
-    >>> tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
-    >>> [" ".join(item.string for item in window) for window in _sliding_window(tokens, 2)]
-    ['def func', 'func (', '( )', ') :', ': ...', '... ', ' ']
-    """
-
-    iterator = iter(iterable)
-    window = deque(islice(iterator, n - 1), maxlen=n)
-    for x in iterator:
-        window.append(x)
-        yield tuple(window)
-
-
 def _sanity_check(name: str, package: typing.Optional[str], level: int) -> None:
     """Verify arguments are "sane".
 
@@ -303,6 +289,10 @@ _BYTECODE_HEADER = f"defer_imports{__version__}".encode()
 """Custom header for defer_imports-instrumented bytecode files. Should be updated with every version release."""
 
 
+# The names of the AST node fields that can hold statements, e.g. the "handlers" of ast.Try or the "cases" of ast.Match.
+_STATEMENT_FIELDS = frozenset({"body", "orelse", "finalbody", "handlers", "cases"})
+
+
 class _DeferredInstrumenter:
     """AST transformer that instruments imports within "with defer_imports.until_use: ..." blocks so that their
     results are assigned to custom keys in the global namespace.
@@ -310,8 +300,6 @@ class _DeferredInstrumenter:
     Notes
     -----
     The transformer doesn't subclass ast.NodeTransformer but instead vendors its logic to avoid the upfront import cost.
-    Additionally, it assumes the AST being instrumented is not empty and "with defer_imports.until_use" is used
-    somewhere in it.
     """
 
     def __init__(
@@ -329,6 +317,10 @@ class _DeferredInstrumenter:
 
         self.scope_depth = 0
         self.escape_hatch_depth = 0
+        self.did_instrument = False
+
+        # Expression contexts carry no state, so share them between generated nodes like ast.parse() does.
+        self._load_ctx = ast.Load()
 
     def visit(self, node: ast.AST) -> typing.Any:
         """Visit a node."""
@@ -351,7 +343,6 @@ class _DeferredInstrumenter:
 
     visit_FunctionDef = _visit_scope
     visit_AsyncFunctionDef = _visit_scope
-    visit_Lambda = _visit_scope
     visit_ClassDef = _visit_scope
 
     def _visit_eager_import_block(self, node: ast.AST) -> ast.AST:
@@ -404,78 +395,43 @@ class _DeferredInstrumenter:
             context += (node.end_lineno, end_col_offset)
         return context
 
-    @staticmethod
-    def _create_import_name_replacement(name: str) -> ast.If:
-        """Create an AST for changing the name of a variable in locals if the variable is a defer_imports proxy.
-
-        The resulting node is almost equivalent to the following code::
-
-            if type(name) is _DeferredImportProxy:
-                @temp_proxy = @local_ns.pop("name")
-                local_ns[@_DeferredImportKey("name", temp_proxy)] = @temp_proxy
-        """
+    def _create_import_key_substitution(self, names: coll_abc.Iterable[str]) -> ast.Expr:
+        """Create an AST for changing the names of variables in locals if the variables are defer_imports proxies.
 
-        if "." in name:
-            name = name.partition(".")[0]
-
-        return ast.If(
-            test=ast.Compare(
-                left=ast.Call(
-                    func=ast.Name("type", ctx=ast.Load()),
-                    args=[ast.Name(name, ctx=ast.Load())],
-                    keywords=[],
-                ),
-                ops=[ast.Is()],
-                comparators=[ast.Name("@_DeferredImportProxy", ctx=ast.Load())],
-            ),
-            body=[
-                ast.Assign(
-                    targets=[ast.Name("@temp_proxy", ctx=ast.Store())],
-                    value=ast.Call(
-                        func=ast.Attribute(value=ast.Name("@local_ns", ctx=ast.Load()), attr="pop", ctx=ast.Load()),
-                        args=[ast.Constant(name)],
-                        keywords=[],
-                    ),
-                ),
-                ast.Assign(
-                    targets=[
-                        ast.Subscript(
-                            value=ast.Name("@local_ns", ctx=ast.Load()),
-                            slice=ast.Call(
-                                func=ast.Name("@_DeferredImportKey", ctx=ast.Load()),
-                                args=[ast.Constant(name), ast.Name("@temp_proxy", ctx=ast.Load())],
-                                keywords=[],
-                            ),
-                            ctx=ast.Store(),
-                        )
-                    ],
-                    value=ast.Name("@temp_proxy", ctx=ast.Load()),
-                ),
-            ],
-            orelse=[],
-        )
+        The resulting node is equivalent to the following code::
 
-    @staticmethod
-    def _initialize_local_ns() -> ast.Assign:
-        """Create an AST that's equivalent to "@local_ns = locals()".
+            defer_imports._install_import_keys(locals(), ("name1", "name2", ...))
 
-        The created @local_ns variable will be used as a temporary reference to the locals to avoid calling locals()
-        repeatedly.
+        Delegating to a helper function keeps the generated code small and the same size regardless of how many imports
+        the block contains. The helper is reached through "defer_imports", which is always bound wherever a
+        "with defer_imports.until_use" block runs, so instrumented modules don't need an extra import for it.
         """
 
-        return ast.Assign(
-            targets=[ast.Name("@local_ns", ctx=ast.Store())],
-            value=ast.Call(func=ast.Name("locals", ctx=ast.Load()), args=[], keywords=[]),
+        load = self._load_ctx
+
+        return ast.Expr(
+            ast.Call(
+                func=ast.Attribute(ast.Name("defer_imports", ctx=load), "_install_import_keys", ctx=load),
+                args=[
+                    ast.Call(func=ast.Name("locals", ctx=load), args=[], keywords=[]),
+                    ast.Tuple(elts=[ast.Constant(name) for name in names], ctx=load),
+                ],
+                keywords=[],
+            )
         )
 
     @staticmethod
-    def _initialize_temp_proxy() -> ast.Assign:
-        """Create an AST that's equivalent to "@temp_proxy = None".
+    def _locate(new_node: ast.AST, ref_node: typing.Optional[ast.AST] = None) -> None:
+        """Give a generated node and its children the location of the node it stands in for, or the start of the file
+        if there isn't one.
 
-        The created @temp_proxy variable will be used as a temporary reference to the current proxy being "fixed".
+        This lets the instrumented tree skip a full ast.fix_missing_locations() pass before compilation, since only the
+        generated nodes get visited.
         """
 
-        return ast.Assign(targets=[ast.Name("@temp_proxy", ctx=ast.Store())], value=ast.Constant(None))
+        if ref_node is not None:
+            ast.copy_location(new_node, ref_node)
+        ast.fix_missing_locations(new_node)
 
     def _substitute_import_keys(self, import_nodes: list[ast.stmt]) -> list[ast.stmt]:
         """Instrument the list of imports.
@@ -483,14 +439,15 @@ class _DeferredInstrumenter:
         Raises
         ------
         SyntaxError:
-            If any of the given nodes are not an import or are a wildcard import.
+            If any of the given nodes are not an import, are a wildcard import, or rebind "defer_imports".
         """
 
-        new_import_nodes = list(import_nodes)
+        self.did_instrument = True
 
-        for i in range(len(import_nodes) - 1, -1, -1):
-            node = import_nodes[i]
+        # Collect the bound names in order, without duplicates, e.g. from "import a; import a.b".
+        bound_names: dict[str, None] = {}
 
+        for node in import_nodes:
             if not isinstance(node, (ast.Import, ast.ImportFrom)):
                 msg = "with defer_imports.until_use blocks must only contain import statements"
                 raise SyntaxError(msg, self._get_node_context(node))  # noqa: TRY004 # Syntax error displays better.
@@ -500,16 +457,20 @@ class _DeferredInstrumenter:
                     msg = "import * not allowed in with defer_imports.until_use blocks"
                     raise SyntaxError(msg, self._get_node_context(node))
 
-                new_import_nodes.insert(i + 1, self._create_import_name_replacement(alias.asname or alias.name))
+                bound_name = alias.asname or alias.name.partition(".")[0]
 
-        # Initialize helper variables.
-        new_import_nodes[0:0] = (self._initialize_local_ns(), self._initialize_temp_proxy())
+                # The generated code looks up the helper through "defer_imports" after the block's imports run.
+                if bound_name == "defer_imports":
+                    msg = "with defer_imports.until_use blocks must not rebind defer_imports"
+                    raise SyntaxError(msg, self._get_node_context(node))
 
-        # Delete helper variables after all is said and done to avoid namespace pollution.
-        temp_names: list[ast.expr] = [ast.Name(name, ctx=ast.Del()) for name in ("@temp_proxy", "@local_ns")]
-        new_import_nodes.append(ast.Delete(targets=temp_names))
+                bound_names[bound_name] = None
 
-        return new_import_nodes
+        # Substitute keys for all the block's proxies at once, after all the imports.
+        substitution_node = self._create_import_key_substitution(bound_names)
+        self._locate(substitution_node, import_nodes[-1])
+
+        return [*import_nodes, substitution_node]
 
     @staticmethod
     def is_until_use(node: ast.With) -> bool:
@@ -532,6 +493,7 @@ class _DeferredInstrumenter:
                 1. "defer_imports.until_use" is being used in a class or function scope.
                 2. "defer_imports.until_use" block contains a statement that isn't an import.
                 3. "defer_imports.until_use" block contains a wildcard import.
+                4. "defer_imports.until_use" block contains an import that rebinds "defer_imports".
         """
 
         if not self.is_until_use(node):
@@ -545,11 +507,18 @@ class _DeferredInstrumenter:
         return node
 
     def visit_Module(self, node: ast.Module) -> ast.AST:
-        """Insert imports necessary to make defer_imports.until_use work properly.
+        """Insert an import of defer_imports for the "with defer_imports.until_use" blocks added by module-level
+        instrumentation.
 
-        The imports are placed after the module docstring and after __future__ imports.
+        The import is placed after the module docstring and after __future__ imports. It's only added once per module,
+        and only if some imports in it were actually instrumented.
         """
 
+        self.generic_visit(node)
+
+        if not (self.module_level and self.did_instrument):
+            return node
+
         expect_docstring = True
         position = 0
 
@@ -568,22 +537,14 @@ class _DeferredInstrumenter:
 
             position += 1
 
-        # Add necessary defer_imports imports.
-        if self.module_level:
-            node.body.insert(position, ast.Import(names=[ast.alias(name="defer_imports")]))
-            position += 1
-
-        defer_class_names = ("_DeferredImportKey", "_DeferredImportProxy")
+        # Add the necessary defer_imports import.
+        position_node = node.body[position] if (position < len(node.body)) else None
 
-        defer_aliases = [ast.alias(name=name, asname=f"@{name}") for name in defer_class_names]
-        key_and_proxy_import = ast.ImportFrom(module="defer_imports", names=defer_aliases, level=0)
-        node.body.insert(position, key_and_proxy_import)
+        defer_imports_import = ast.Import(names=[ast.alias(name="defer_imports")])
+        self._locate(defer_imports_import, position_node)
+        node.body.insert(position, defer_imports_import)
 
-        # Clean up the namespace.
-        key_and_proxy_names: list[ast.expr] = [ast.Name(f"@{name}", ctx=ast.Del()) for name in defer_class_names]
-        node.body.append(ast.Delete(targets=key_and_proxy_names))
-
-        return self.generic_visit(node)
+        return node
 
     @staticmethod
     def _is_non_wildcard_import(obj: object) -> _TypeGuard[typing.Union[ast.Import, ast.ImportFrom]]:
@@ -593,7 +554,10 @@ class _DeferredInstrumenter:
 
     @staticmethod
     def _is_defer_imports_import(node: typing.Union[ast.Import, ast.ImportFrom]) -> bool:
-        """Check if the given import node imports from defer_imports."""
+        """Check if the given import node imports from defer_imports or binds the name "defer_imports"."""
+
+        if any(alias.asname == "defer_imports" for alias in node.names):
+            return True
 
         if isinstance(node, ast.Import):
             return any(alias.name.partition(".")[0] == "defer_imports" for alias in node.names)
@@ -604,18 +568,22 @@ class _DeferredInstrumenter:
         """Wrap consecutive import nodes within a list of statements using a "defer_imports.until_use" block and
         instrument them.
 
-        The first node must be an import node.
+        The first node must be an import node that should be instrumented.
         """
 
-        import_range = tuple(takewhile(lambda i: self._is_non_wildcard_import(nodes[i]), range(start, len(nodes))))
+        import_range = tuple(takewhile(lambda i: self._is_import_to_instrument(nodes[i]), range(start, len(nodes))))
         import_slice = slice(import_range[0], import_range[-1] + 1)
         import_nodes = nodes[import_slice]
 
         instrumented_nodes = self._substitute_import_keys(import_nodes)
         wrapper_node = ast.With(
-            [ast.withitem(ast.Attribute(ast.Name("defer_imports", ast.Load()), "until_use", ast.Load()))],
+            [ast.withitem(ast.Attribute(ast.Name("defer_imports", self._load_ctx), "until_use", self._load_ctx))],
             body=instrumented_nodes,
         )
+        ast.copy_location(wrapper_node, import_nodes[0])
+        wrapper_node.end_lineno = import_nodes[-1].end_lineno
+        wrapper_node.end_col_offset = import_nodes[-1].end_col_offset
+        self._locate(wrapper_node)
 
         nodes[import_slice] = [wrapper_node]
         return wrapper_node
@@ -635,12 +603,13 @@ class _DeferredInstrumenter:
     def generic_visit(self, node: ast.AST) -> ast.AST:
         """Called if no explicit visitor function exists for a node.
 
-        In addition to regular functionality, conditionally intercept global sequences of import statements to wrap them
-        in "with defer_imports.until_use" blocks.
+        Unlike ast.NodeTransformer.generic_visit(), only fields that hold statements are visited, since expressions
+        can't contain imports or with blocks. In addition, conditionally intercept global sequences of import statements
+        to wrap them in "with defer_imports.until_use" blocks.
         """
 
         for field, old_value in ast.iter_fields(node):
-            if isinstance(old_value, list):
+            if field in _STATEMENT_FIELDS and isinstance(old_value, list):
                 new_values: list[typing.Any] = []
                 for i, value in enumerate(old_value):  # pyright: ignore [reportUnknownArgumentType, reportUnknownVariableType]
                     if self._is_import_to_instrument(value):  # pyright: ignore [reportUnknownArgumentType]
@@ -654,44 +623,52 @@ class _DeferredInstrumenter:
                             continue
                     new_values.append(value)
                 old_value[:] = new_values
-            elif isinstance(old_value, ast.AST):
-                new_node = self.visit(old_value)
-                if new_node is None:
-                    delattr(node, field)
-                else:
-                    setattr(node, field, new_node)
         return node
 
 
-def _check_source_for_defer_usage(data: typing.Union[_ReadableBuffer, str]) -> tuple[str, bool]:
-    """Get the encoding of the given code and also check if it uses "with defer_imports.until_use"."""
+def _detect_encoding(data: _ReadableBuffer) -> str:
+    """Get the encoding of the given source bytes, the same way tokenize.detect_encoding() would.
+
+    Notes
+    -----
+    Most source files have no encoding declaration, so check for that directly first. A declaration can only be in the
+    first two lines [1]_; searching further than that, e.g. when lines end with bare carriage returns, only costs a
+    fallback.
+
+    References
+    ----------
+    .. [1] https://peps.python.org/pep-0263/
+    """
 
-    _TOK_NAME, _TOK_OP = tokenize.NAME, tokenize.OP
+    data = bytes(data)
+    first_two_lines_end = data.find(b"\n", data.find(b"\n") + 1)
+    first_two_lines = data if (first_two_lines_end == -1) else data[:first_two_lines_end]
 
-    if isinstance(data, str):
-        token_stream = tokenize.generate_tokens(io.StringIO(data).readline)
-        encoding = "utf-8"
+    if b"coding" not in first_two_lines:
+        return "utf-8-sig" if data.startswith(b"\xef\xbb\xbf") else "utf-8"
     else:
-        token_stream = tokenize.tokenize(io.BytesIO(data).readline)
-        encoding = next(token_stream).string
-
-    uses_defer = any(
-        (tok1.type == _TOK_NAME and tok1.string == "with")
-        and (tok2.type == _TOK_NAME and tok2.string == "defer_imports")
-        and (tok3.type == _TOK_OP and tok3.string == ".")
-        and (tok4.type == _TOK_NAME and tok4.string == "until_use")
-        for tok1, tok2, tok3, tok4 in _sliding_window(token_stream, 4)
-    )
+        return tokenize.detect_encoding(io.BytesIO(data).readline)[0]
+
+
+def _may_use_defer(data: typing.Union[_ReadableBuffer, str]) -> bool:
+    """Cheaply check if the given code could use "with defer_imports.until_use" before doing so more thoroughly.
+
+    Notes
+    -----
+    A substring search is far faster than tokenizing. Since source encodings must be ASCII-compatible, the search works
+    on undecoded bytes as well.
+    """
 
-    return encoding, uses_defer
+    if isinstance(data, str):
+        return "until_use" in data
+    else:
+        return b"until_use" in bytes(data)
 
 
-def _check_ast_for_defer_usage(data: ast.AST) -> tuple[str, bool]:
-    """Check if the given AST uses "with defer_imports.until_use". Also assume "utf-8" is the the encoding."""
+def _check_ast_for_defer_usage(data: ast.AST) -> bool:
+    """Check if the given AST uses "with defer_imports.until_use"."""
 
-    encoding = "utf-8"
-    uses_defer = any(isinstance(node, ast.With) and _DeferredInstrumenter.is_until_use(node) for node in ast.walk(data))
-    return encoding, uses_defer
+    return any(isinstance(node, ast.With) and _DeferredInstrumenter.is_until_use(node) for node in ast.walk(data))
 
 
 class _DeferredFileLoader(SourceFileLoader):
@@ -701,6 +678,23 @@ class _DeferredFileLoader(SourceFileLoader):
         super().__init__(*args, **kwargs)
         self.defer_module_level: bool = False
 
+    @property
+    def _bytecode_header(self) -> bytes:
+        """The bytecode header for this loader. Module-level instrumentation compiles the same source differently, so
+        the header records which kind was used.
+        """
+
+        return _BYTECODE_HEADER + (b"1" if self.defer_module_level else b"0")
+
+    def _may_instrument_source(self) -> bool:
+        """Check if this loader's source file might be instrumented.
+
+        Modules that can't be instrumented compile the same as they would without defer_imports, so their bytecode is
+        left interchangeable with that of the regular loaders.
+        """
+
+        return _may_use_defer(super().get_data(self.path))
+
     def get_data(self, path: str) -> bytes:
         """Return the data from path as raw bytes.
 
@@ -708,6 +702,7 @@ class _DeferredFileLoader(SourceFileLoader):
         -----
         If the path points to a bytecode file, check for a defer_imports-specific header. If the header is invalid,
         raise OSError to invalidate the bytecode; importlib._boostrap_external.SourceLoader.get_code expects this [1]_.
+        Bytecode without the header is only accepted if the source couldn't have been instrumented.
 
         Another option is to monkeypatch importlib.util.cache_from_source, as beartype [2]_ and typeguard do, but that
         seems unnecessary.
@@ -724,6 +719,9 @@ class _DeferredFileLoader(SourceFileLoader):
             return data
 
         if not data.startswith(b"defer_imports"):
+            if not self._may_instrument_source():
+                return data
+
             msg = '"defer_imports" header missing from bytecode'
             raise OSError(msg)
 
@@ -731,23 +729,28 @@ class _DeferredFileLoader(SourceFileLoader):
             msg = '"defer_imports" header is outdated'
             raise OSError(msg)
 
-        return data[len(_BYTECODE_HEADER) :]
+        header = self._bytecode_header
+        if not data.startswith(header):
+            msg = '"defer_imports" header is for a different kind of instrumentation'
+            raise OSError(msg)
+
+        return data[len(header) :]
 
     def set_data(self, path: str, data: _ReadableBuffer, *, _mode: int = 0o666) -> None:
         """Write bytes data to a file.
 
         Notes
         -----
-        If the file is a bytecode one, prepend a defer_imports-specific header to it. That way, instrumented bytecode
-        can be identified and invalidated later if necessary [1]_.
+        If the file is a bytecode one and the source might have been instrumented, prepend a defer_imports-specific
+        header to it. That way, instrumented bytecode can be identified and invalidated later if necessary [1]_.
 
         References
         ----------
         .. [1] https://gregoryszorc.com/blog/2017/03/13/from-__past__-import-bytes_literals/
         """
 
-        if path.endswith(tuple(BYTECODE_SUFFIXES)):
-            data = _BYTECODE_HEADER + data
+        if path.endswith(tuple(BYTECODE_SUFFIXES)) and self._may_instrument_source():
+            data = self._bytecode_header + data
 
         return super().set_data(path, data, _mode=_mode)
 
@@ -772,20 +775,30 @@ class _DeferredFileLoader(SourceFileLoader):
             return super().source_to_code(data, path, _optimize=_optimize)  # pyright: ignore # See note above.
 
         if isinstance(data, ast.AST):
-            encoding, uses_defer = _check_ast_for_defer_usage(data)
-        else:
-            encoding, uses_defer = _check_source_for_defer_usage(data)
+            if not _check_ast_for_defer_usage(data):
+                return super().source_to_code(data, path, _optimize=_optimize)  # pyright: ignore # See note above.
 
-        if not uses_defer:
-            return super().source_to_code(data, path, _optimize=_optimize)  # pyright: ignore # See note above.
-
-        if isinstance(data, ast.AST):
-            orig_tree = data
+            # A given tree isn't guaranteed to have complete location information.
+            orig_tree = ast.fix_missing_locations(data)
+            encoding = "utf-8"
         else:
+            # Avoid parsing the majority of modules, which won't be using defer_imports.
+            if not _may_use_defer(data):
+                return super().source_to_code(data, path, _optimize=_optimize)  # pyright: ignore # See note above.
+
             orig_tree = ast.parse(data, path, "exec")
 
+            # Module-level instrumentation only applies to modules that use "with defer_imports.until_use" somewhere.
+            # Otherwise, uses of it are found and validated in the same pass that instruments them, and a tree without
+            # any is left as is.
+            if self.defer_module_level and not _check_ast_for_defer_usage(orig_tree):
+                return super().source_to_code(orig_tree, path, _optimize=_optimize)  # pyright: ignore # See note above.
+
+            encoding = "utf-8" if isinstance(data, str) else _detect_encoding(data)
+
+        # The instrumenter locates the nodes it generates, so the tree doesn't need another pass before compilation.
         transformer = _DeferredInstrumenter(data, path, encoding, module_level=self.defer_module_level)
-        new_tree = ast.fix_missing_locations(transformer.visit(orig_tree))
+        new_tree = transformer.visit(orig_tree)
 
         return super().source_to_code(new_tree, path, _optimize=_optimize)  # pyright: ignore # See note above.
 
@@ -843,7 +856,13 @@ class _DeferredFileFinder(FileFinder):
         return spec
 
 
-_DEFER_PATH_HOOK = _DeferredFileFinder.path_hook((_DeferredFileLoader, SOURCE_SUFFIXES))
+# Mirrors importlib._bootstrap_external._get_supported_file_loaders() with the source loader swapped out, so that path
+# entries handled by this hook can still provide extension modules and sourceless bytecode.
+_DEFER_PATH_HOOK = _DeferredFileFinder.path_hook(
+    (ExtensionFileLoader, EXTENSION_SUFFIXES),
+    (_DeferredFileLoader, SOURCE_SUFFIXES),
+    (SourcelessFileLoader, BYTECODE_SUFFIXES),
+)
 """Singleton import path hook that enables defer_imports's instrumentation."""
 
 
@@ -871,6 +890,19 @@ class _DeferConfig:
         return f'{type(self).__name__}({", ".join(f"{attr}={getattr(self, attr)!r}" for attr in attrs)})'
 
 
+def _clear_cached_path_finders(finder_cls: type[imp_abc.PathEntryFinder]) -> None:
+    """Remove path entry finders of exactly the given type from sys.path_importer_cache.
+
+    Only the affected entries are evicted, so they get recreated with the current path hooks on their next use while
+    other cached finders are left alone.
+    """
+
+    cache = sys.path_importer_cache
+    for path_entry, finder in list(cache.items()):
+        if type(finder) is finder_cls:
+            del cache[path_entry]
+
+
 @_final
 class ImportHookContext:
     """The context manager returned by install_import_hook(). Can reset defer_imports's configuration to its previous
@@ -914,6 +946,7 @@ class ImportHookContext:
         except ValueError:
             pass
         else:
+            _clear_cached_path_finders(_DeferredFileFinder)
             PathFinder.invalidate_caches()
 
 
@@ -965,6 +998,9 @@ def install_import_hook(
         except ValueError:
             hook_insert_index = 0
 
+        # NOTE: Path entry finders that are already cached, e.g. for the stdlib and site-packages, are left alone.
+        #       Replacing them would route those modules through the instrumenting loader, which would rewrite their
+        #       bytecode caches with a header that regular loaders reject.
         sys.path_hooks.insert(hook_insert_index, _DEFER_PATH_HOOK)
 
     config = _DeferConfig(apply_all, module_names, recursive, loader_class)
@@ -992,6 +1028,17 @@ _is_deferred = contextvars.ContextVar("is_deferred", default=False)
 class _DeferredImportProxy:
     """Proxy for a deferred __import__ call."""
 
+    # __dict__ is only populated with nested proxies for submodules, e.g. from "import a; import a.b".
+    __slots__ = (
+        "defer_proxy_name",
+        "defer_proxy_global_ns",
+        "defer_proxy_local_ns",
+        "defer_proxy_fromlist",
+        "defer_proxy_level",
+        "defer_proxy_sub",
+        "__dict__",
+    )
+
     def __init__(
         self,
         name: str,
@@ -1081,8 +1128,9 @@ class _DeferredImportKey(str):
 
         return True
 
-    def __hash__(self) -> int:
-        return super().__hash__()
+    # Use str's hash directly instead of through a Python-level method. It's computed once and cached on the string, so
+    # dict operations involving keys don't run any Python code just to hash them.
+    __hash__ = str.__hash__
 
     def _resolve(self) -> None:
         """Perform an actual import for the given proxy and bind the result to the relevant namespace."""
@@ -1104,25 +1152,42 @@ class _DeferredImportKey(str):
                 attr_val.defer_proxy_global_ns = attr_val.defer_proxy_local_ns = module_vars
 
         # 3. Replace the proxy with the resolved module or module attribute in the relevant namespace.
-        # 3.1. Get the regular string key and the relevant namespace.
+        # NOTE: Both the key and the proxy are dropped from the namespace here, so later lookups get the resolved value
+        #       with a plain str key and never go through the proxy again. Proxies don't need a fast path for attribute
+        #       access after resolution, e.g. by swapping their __class__, because nothing should be using them by then.
+        # 3.1. Resolve any requested attribute access.
+        if proxy.defer_proxy_fromlist:
+            value = getattr(module, proxy.defer_proxy_fromlist[0])
+        elif proxy.defer_proxy_sub:
+            value = getattr(module, proxy.defer_proxy_sub)
+        else:
+            value = module
+
+        # 3.2. Get the regular string key and the relevant namespace.
         key = str(self)
         namespace = proxy.defer_proxy_local_ns
 
-        # 3.2. Replace the deferred version of the key to avoid it sticking around.
+        # 3.3. Replace the deferred version of the key to avoid it sticking around, binding the resolved value in the
+        # same step instead of rebinding the proxy first.
         # This will trigger __eq__ again, so we use is_deferred to prevent recursion.
         _is_def_tok = _is_deferred.set(True)
         try:
-            namespace[key] = namespace.pop(key)
+            del namespace[key]
+            namespace[key] = value
         finally:
             _is_deferred.reset(_is_def_tok)
 
-        # 3.3. Resolve any requested attribute access.
-        if proxy.defer_proxy_fromlist:
-            namespace[key] = getattr(module, proxy.defer_proxy_fromlist[0])
-        elif proxy.defer_proxy_sub:
-            namespace[key] = getattr(module, proxy.defer_proxy_sub)
-        else:
-            namespace[key] = module
+
+def _install_import_keys(namespace: coll_abc.MutableMapping[str, object], names: coll_abc.Iterable[str], /) -> None:
+    """Rebind the given names in the namespace to defer_imports keys if they're bound to proxies.
+
+    Instrumented code calls this at the end of every "with defer_imports.until_use" block.
+    """
+
+    for name in names:
+        value = namespace[name]
+        if type(value) is _DeferredImportProxy:
+            namespace[_DeferredImportKey(name, value)] = namespace.pop(name)
 
 
 def _deferred___import__(
@@ -1168,6 +1233,10 @@ def _deferred___import__(
 
                 return base_parent
 
+    # NOTE: Proxies aren't cached and shared between import sites, even for the same module. Each one is bound to the
+    #       namespaces of the module that created it, which are passed along to __import__ on resolution, and nested
+    #       submodule proxies get set on it as attributes, so a shared proxy would leak one module's imports into
+    #       another's.
     return _DeferredImportProxy(name, globals, locals, fromlist, level)
 
 
@@ -1184,6 +1253,7 @@ class DeferredContext:
             1. It is being used in a class or function scope.
             2. It contains a statement that isn't an import.
             3. It contains a wildcard import.
+            4. It contains an import that rebinds "defer_imports".
 
     Notes
     -----
@@ -2,14 +2,18 @@
 
 Notes
 -----
-A proxy's presence in a namespace is checked via stringifying the namespace and then substring matching with the
-expected proxy repr, as that's the only way to inspect it without causing it to resolve.
+A proxy's presence in a namespace is checked via stringifying the namespace entries with defer_imports keys and then
+matching against the expected entry repr, as that's the only way to inspect it without causing it to resolve.
 """
 
 import contextlib
 import importlib.util
+import os
+import py_compile
+import subprocess
 import sys
 import types
+from importlib.machinery import FileFinder, PathFinder, SourceFileLoader
 from pathlib import Path
 from typing import Any, cast
 
@@ -18,8 +22,11 @@ import pytest
 from defer_imports import (
     _BYTECODE_HEADER,
     _DEFER_PATH_HOOK,
+    _DeferredFileFinder,
     _DeferredFileLoader,
+    _DeferredImportKey,
     _DeferredInstrumenter,
+    _detect_encoding,
     install_import_hook,
 )
 
@@ -53,6 +60,16 @@ def create_sample_module(
     return spec, module, module_path
 
 
+def deferred_entries(namespace: dict[str, Any]):
+    """Get the reprs of the namespace entries with defer_imports keys.
+
+    Iterating over the namespace's items doesn't trigger key comparisons, so none of the proxies get resolved. It's also
+    cheaper than stringifying the whole namespace, which can be large.
+    """
+
+    return {f"{key!r}: {value!r}" for key, value in namespace.items() if isinstance(key, _DeferredImportKey)}
+
+
 @contextlib.contextmanager
 def temp_cache_module(name: str, module: types.ModuleType):
     """Add a module to sys.modules and then attempt to remove it on exit."""
@@ -105,6 +122,85 @@ def test_path_hook_installation():
     assert len(sys.path_hooks) == before_length
 
 
+def test_path_hook_uninstallation_refreshes_cached_finders(tmp_path: Path):
+    """Test that path entry finders cached while the path hook is installed get replaced after uninstalling it, and that
+    finders cached before installing it are left alone.
+    """
+
+    path_entry = str(tmp_path)
+    new_path = tmp_path / "new"
+    new_path.mkdir()
+    new_path_entry = str(new_path)
+
+    def cached_finder_type(entry: str) -> type:
+        PathFinder.find_spec("sample", [entry])
+        return type(sys.path_importer_cache[entry])
+
+    try:
+        assert cached_finder_type(path_entry) is FileFinder
+
+        with install_import_hook(uninstall_after=True):
+            assert cached_finder_type(path_entry) is FileFinder
+            assert cached_finder_type(new_path_entry) is _DeferredFileFinder
+
+        assert cached_finder_type(new_path_entry) is FileFinder
+    finally:
+        sys.path_importer_cache.pop(path_entry, None)
+        sys.path_importer_cache.pop(new_path_entry, None)
+
+
+def test_path_hook_installation_keeps_other_imports_working(tmp_path: Path):
+    """Test that extension modules, sourceless bytecode, and not-yet-imported stdlib modules can still be imported after
+    installing the path hook.
+
+    This runs in a subprocess so that the imports don't pollute the test session.
+    """
+
+    # Provide a sourceless module on a path entry that the path hook will handle.
+    source_path = tmp_path / "sourceless_sample.py"
+    source_path.write_text("VALUE = 1\n", encoding="utf-8")
+    py_compile.compile(str(source_path), cfile=str(tmp_path / "sourceless_sample.pyc"), doraise=True)
+    source_path.unlink()
+
+    script = f"""\
+import sys
+import defer_imports
+
+defer_imports.install_import_hook()
+sys.path.insert(0, {str(tmp_path)!r})
+
+import _struct
+import email.mime.text
+import sourceless_sample
+
+assert sourceless_sample.VALUE == 1
+"""
+
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env, check=False)  # noqa: S603
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        pytest.param(b"import inspect\n", id="no declaration"),
+        pytest.param(b"\xef\xbb\xbfimport inspect\n", id="utf-8 BOM"),
+        pytest.param(b"# -*- coding: latin-1 -*-\nimport inspect\n", id="declaration on first line"),
+        pytest.param(b"#!/usr/bin/env python\n# coding: ascii\nimport inspect\n", id="declaration on second line"),
+        pytest.param(b"\n\n# coding: latin-1\nimport inspect\n", id="ignores declaration after second line"),
+        pytest.param(b"# coding: latin-1\rimport inspect\r", id="carriage return line endings"),
+    ],
+)
+def test_detect_encoding(source: bytes):
+    """Test that the shortcuts for detecting a source's encoding match the tokenize module."""
+
+    import io
+    import tokenize
+
+    assert _detect_encoding(source) == tokenize.detect_encoding(io.BytesIO(source).readline)[0]
+
+
 @pytest.mark.parametrize(
     ("before", "after"),
     [
@@ -112,19 +208,42 @@ def test_path_hook_installation():
             """'''Module docstring here'''""",
             '''\
 """Module docstring here"""
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
-del @_DeferredImportKey, @_DeferredImportProxy
 ''',
-            id="inserts statements after module docstring",
+            id="does nothing if defer_imports.until_use isn't used",
+        ),
+        pytest.param(
+            """\
+'''Module docstring here'''
+import defer_imports
+
+with defer_imports.until_use:
+    import inspect
+""",
+            '''\
+"""Module docstring here"""
+import defer_imports
+with defer_imports.until_use:
+    import inspect
+    defer_imports._install_import_keys(locals(), ('inspect',))
+''',
+            id="leaves module docstring in place",
         ),
         pytest.param(
-            """from __future__ import annotations""",
             """\
 from __future__ import annotations
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
-del @_DeferredImportKey, @_DeferredImportProxy
+import defer_imports
+
+with defer_imports.until_use:
+    import inspect
+""",
+            """\
+from __future__ import annotations
+import defer_imports
+with defer_imports.until_use:
+    import inspect
+    defer_imports._install_import_keys(locals(), ('inspect',))
 """,
-            id="Inserts statements after __future__ import",
+            id="leaves __future__ import in place",
         ),
         pytest.param(
             """\
@@ -136,12 +255,10 @@ with defer_imports.until_use, nullcontext():
     import inspect
 """,
             """\
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 from contextlib import nullcontext
 import defer_imports
 with defer_imports.until_use, nullcontext():
     import inspect
-del @_DeferredImportKey, @_DeferredImportProxy
 """,
             id="does nothing if used with another context manager",
         ),
@@ -153,17 +270,10 @@ with defer_imports.until_use:
     import inspect
 """,
             """\
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 import defer_imports
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import inspect
-    if type(inspect) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('inspect')
-        @local_ns[@_DeferredImportKey('inspect', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('inspect',))
 """,
             id="regular import",
         ),
@@ -176,21 +286,11 @@ with defer_imports.until_use:
     import importlib.abc
 """,
             """\
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 import defer_imports
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import importlib
-    if type(importlib) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('importlib')
-        @local_ns[@_DeferredImportKey('importlib', @temp_proxy)] = @temp_proxy
     import importlib.abc
-    if type(importlib) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('importlib')
-        @local_ns[@_DeferredImportKey('importlib', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('importlib',))
 """,
             id="mixed imports",
         ),
@@ -202,17 +302,10 @@ with defer_imports.until_use:
     from . import a
 """,
             """\
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 import defer_imports
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     from . import a
-    if type(a) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('a')
-        @local_ns[@_DeferredImportKey('a', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('a',))
 """,
             id="relative import",
         ),
@@ -226,9 +319,9 @@ def test_instrumentation(before: str, after: str):
     filename = "<unknown>"
     orig_tree = ast.parse(before, filename, "exec")
     transformer = _DeferredInstrumenter(before, filename)
-    new_tree = ast.fix_missing_locations(transformer.visit(orig_tree))
+    new_tree = transformer.visit(orig_tree)
 
-    assert f"{ast.unparse(new_tree)}\n" == after
+    assert ast.dump(new_tree) == ast.dump(ast.parse(after))
 
 
 @pytest.mark.parametrize(
@@ -240,45 +333,39 @@ import inspect
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import inspect
-    if type(inspect) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('inspect')
-        @local_ns[@_DeferredImportKey('inspect', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('inspect',))
 """,
             id="regular import",
         ),
         pytest.param(
             """\
+'''Module docstring here'''
+import inspect
+""",
+            '''\
+"""Module docstring here"""
+import defer_imports
+with defer_imports.until_use:
+    import inspect
+    defer_imports._install_import_keys(locals(), ('inspect',))
+''',
+            id="inserts import after module docstring",
+        ),
+        pytest.param(
+            """\
 import hello
 import world
 import foo
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import hello
-    if type(hello) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('hello')
-        @local_ns[@_DeferredImportKey('hello', @temp_proxy)] = @temp_proxy
     import world
-    if type(world) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('world')
-        @local_ns[@_DeferredImportKey('world', @temp_proxy)] = @temp_proxy
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('hello', 'world', 'foo'))
 """,
             id="multiple imports consecutively",
         ),
@@ -293,29 +380,14 @@ import foo
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import hello
-    if type(hello) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('hello')
-        @local_ns[@_DeferredImportKey('hello', @temp_proxy)] = @temp_proxy
     import world
-    if type(world) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('world')
-        @local_ns[@_DeferredImportKey('world', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('hello', 'world'))
 print('hello')
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('foo',))
 """,
             id="multiple imports separated by statement 1",
         ),
@@ -331,31 +403,16 @@ import foo
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import hello
-    if type(hello) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('hello')
-        @local_ns[@_DeferredImportKey('hello', @temp_proxy)] = @temp_proxy
     import world
-    if type(world) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('world')
-        @local_ns[@_DeferredImportKey('world', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('hello', 'world'))
 
 def do_the_thing(a: int) -> int:
     return a
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('foo',))
 """,
             id="multiple imports separated by statement 2",
         ),
@@ -369,20 +426,13 @@ def do_the_thing(a: int) -> int:
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import hello
-    if type(hello) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('hello')
-        @local_ns[@_DeferredImportKey('hello', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('hello',))
 
 def do_the_thing(a: int) -> int:
     import world
     return a
-del @_DeferredImportKey, @_DeferredImportProxy
 """,
             id="nothing done for imports within function",
         ),
@@ -394,25 +444,13 @@ import foo
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import hello
-    if type(hello) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('hello')
-        @local_ns[@_DeferredImportKey('hello', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('hello',))
 from world import *
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('foo',))
 """,
             id="avoids doing anything with wildcard imports",
         ),
@@ -427,28 +465,16 @@ import bar
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('foo',))
 try:
     import hello
 finally:
     pass
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import bar
-    if type(bar) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('bar')
-        @local_ns[@_DeferredImportKey('bar', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('bar',))
 """,
             id="avoids imports in try-finally",
         ),
@@ -461,26 +487,14 @@ import bar
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('foo',))
 with nullcontext():
     import hello
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import bar
-    if type(bar) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('bar')
-        @local_ns[@_DeferredImportKey('bar', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('bar',))
 """,
             id="avoids imports in non-defer_imports.until_use with block",
         ),
@@ -494,36 +508,46 @@ import bar
 """,
             """\
 import defer_imports
-from defer_imports import _DeferredImportKey as @_DeferredImportKey, _DeferredImportProxy as @_DeferredImportProxy
 import defer_imports
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import foo
-    if type(foo) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('foo')
-        @local_ns[@_DeferredImportKey('foo', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('foo',))
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import hello
-    if type(hello) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('hello')
-        @local_ns[@_DeferredImportKey('hello', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
+    defer_imports._install_import_keys(locals(), ('hello',))
 with defer_imports.until_use:
-    @local_ns = locals()
-    @temp_proxy = None
     import bar
-    if type(bar) is @_DeferredImportProxy:
-        @temp_proxy = @local_ns.pop('bar')
-        @local_ns[@_DeferredImportKey('bar', @temp_proxy)] = @temp_proxy
-    del @temp_proxy, @local_ns
-del @_DeferredImportKey, @_DeferredImportProxy
+    defer_imports._install_import_keys(locals(), ('bar',))
 """,
             id="still instruments imports in defer_imports.until_use with block",
         ),
+        pytest.param(
+            """\
+import foo
+import inspect as defer_imports
+""",
+            """\
+import defer_imports
+with defer_imports.until_use:
+    import foo
+    defer_imports._install_import_keys(locals(), ('foo',))
+import inspect as defer_imports
+""",
+            id="avoids imports that bind defer_imports",
+        ),
+        pytest.param(
+            """\
+def do_the_thing(a: int) -> int:
+    import world
+    return a
+""",
+            """\
+def do_the_thing(a: int) -> int:
+    import world
+    return a
+""",
+            id="does nothing if no imports are instrumented",
+        ),
     ],
 )
 def test_module_instrumentation(before: str, after: str):
@@ -534,9 +558,9 @@ def test_module_instrumentation(before: str, after: str):
     filename = "<unknown>"
     orig_tree = ast.parse(before, filename, "exec")
     transformer = _DeferredInstrumenter(before, filename, module_level=True)
-    new_tree = ast.fix_missing_locations(transformer.visit(orig_tree))
+    new_tree = transformer.visit(orig_tree)
 
-    assert f"{ast.unparse(new_tree)}\n" == after
+    assert ast.dump(new_tree) == ast.dump(ast.parse(after))
 
 
 # endregion
@@ -579,9 +603,9 @@ with defer_imports.until_use:
     print(repr(vars(module)))
 
     expected_inspect_repr = "<key for 'inspect' import>: <proxy for 'import inspect'>"
-    assert expected_inspect_repr in repr(vars(module))
+    assert expected_inspect_repr in deferred_entries(vars(module))
     assert module.inspect
-    assert expected_inspect_repr not in repr(vars(module))
+    assert expected_inspect_repr not in deferred_entries(vars(module))
 
     assert module.inspect is sys.modules["inspect"]
 
@@ -604,7 +628,7 @@ with defer_imports.until_use:
 
     expected_gin_repr = "<key for 'gin' import>: <proxy for 'import inspect'>"
 
-    assert expected_gin_repr in repr(vars(module))
+    assert expected_gin_repr in deferred_entries(vars(module))
 
     with pytest.raises(NameError):
         exec("inspect", vars(module))
@@ -612,9 +636,9 @@ with defer_imports.until_use:
     with pytest.raises(AttributeError):
         assert module.inspect
 
-    assert expected_gin_repr in repr(vars(module))
+    assert expected_gin_repr in deferred_entries(vars(module))
     assert module.gin
-    assert expected_gin_repr not in repr(vars(module))
+    assert expected_gin_repr not in deferred_entries(vars(module))
 
     assert sys.modules["inspect"] is module.gin
 
@@ -636,13 +660,13 @@ with defer_imports.until_use:
     spec.loader.exec_module(module)
 
     expected_importlib_repr = "<key for 'importlib' import>: <proxy for 'import importlib.abc'>"
-    assert expected_importlib_repr in repr(vars(module))
+    assert expected_importlib_repr in deferred_entries(vars(module))
 
     assert module.importlib
     assert module.importlib.abc
     assert module.importlib.abc.MetaPathFinder
 
-    assert expected_importlib_repr not in repr(vars(module))
+    assert expected_importlib_repr not in deferred_entries(vars(module))
 
 
 def test_regular_import_nested_with_rename(tmp_path: Path):
@@ -659,7 +683,7 @@ with defer_imports.until_use:
 
     # Make sure the right proxy is in the namespace.
     expected_xyz_repr = "<key for 'xyz' import>: <proxy for 'import collections.abc as ...'>"
-    assert expected_xyz_repr in repr(vars(module))
+    assert expected_xyz_repr in deferred_entries(vars(module))
 
     # Make sure the intermediate imports or proxies for them aren't in the namespace.
     with pytest.raises(NameError):
@@ -675,9 +699,9 @@ with defer_imports.until_use:
         assert module.collections.abc
 
     # Make sure xyz resolves properly.
-    assert expected_xyz_repr in repr(vars(module))
+    assert expected_xyz_repr in deferred_entries(vars(module))
     assert module.xyz
-    assert expected_xyz_repr not in repr(vars(module))
+    assert expected_xyz_repr not in deferred_entries(vars(module))
     assert module.xyz is sys.modules["collections"].abc
 
     # Make sure only the resolved xyz remains in the namespace.
@@ -708,20 +732,20 @@ with defer_imports.until_use:
 
     expected_isfunction_repr = "<key for 'isfunction' import>: <proxy for 'from inspect import isfunction'>"
     expected_signature_repr = "<key for 'signature' import>: <proxy for 'from inspect import signature'>"
-    assert expected_isfunction_repr in repr(vars(module))
-    assert expected_signature_repr in repr(vars(module))
+    assert expected_isfunction_repr in deferred_entries(vars(module))
+    assert expected_signature_repr in deferred_entries(vars(module))
 
     with pytest.raises(NameError):
         exec("inspect", vars(module))
 
-    assert expected_isfunction_repr in repr(vars(module))
+    assert expected_isfunction_repr in deferred_entries(vars(module))
     assert module.isfunction
-    assert expected_isfunction_repr not in repr(vars(module))
+    assert expected_isfunction_repr not in deferred_entries(vars(module))
     assert module.isfunction is sys.modules["inspect"].isfunction
 
-    assert expected_signature_repr in repr(vars(module))
+    assert expected_signature_repr in deferred_entries(vars(module))
     assert module.signature
-    assert expected_signature_repr not in repr(vars(module))
+    assert expected_signature_repr not in deferred_entries(vars(module))
     assert module.signature is sys.modules["inspect"].signature
 
 
@@ -738,7 +762,7 @@ with defer_imports.until_use:
     spec.loader.exec_module(module)
 
     expected_my_signature_repr = "<key for 'MySignature' import>: <proxy for 'from inspect import Signature'>"
-    assert expected_my_signature_repr in repr(vars(module))
+    assert expected_my_signature_repr in deferred_entries(vars(module))
 
     with pytest.raises(NameError):
         exec("inspect", vars(module))
@@ -746,17 +770,19 @@ with defer_imports.until_use:
     with pytest.raises(NameError):
         exec("Signature", vars(module))
 
-    assert expected_my_signature_repr in repr(vars(module))
+    assert expected_my_signature_repr in deferred_entries(vars(module))
     assert str(module.MySignature) == "<class 'inspect.Signature'>"  # Resolves on use.
-    assert expected_my_signature_repr not in repr(vars(module))
+    assert expected_my_signature_repr not in deferred_entries(vars(module))
     assert module.MySignature is sys.modules["inspect"].Signature
 
 
-def test_deferred_header_in_instrumented_pycache(tmp_path: Path):
+def test_deferred_header_in_instrumented_pycache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
     """Test that the defer_imports-specific bytecode header is being prepended to the bytecode cache files of
     defer_imports-instrumented modules.
     """
 
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+
     source = """\
 import defer_imports
 
@@ -776,6 +802,63 @@ with defer_imports.until_use:
     assert header == _BYTECODE_HEADER
 
 
+def test_regular_pycache_for_uninstrumented_module(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that modules which can't be instrumented share bytecode cache files with the regular loaders."""
+
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+
+    source = """\
+import inspect
+"""
+
+    spec, module, path = create_sample_module(tmp_path, source, loader_type=SourceFileLoader)
+    assert spec.loader
+    spec.loader.exec_module(module)
+
+    expected_cache = Path(importlib.util.cache_from_source(str(path)))
+    regular_bytecode = expected_cache.read_bytes()
+
+    # The cached bytecode should be used as is, without compiling the source again.
+    def _fail_source_to_code(*args: object, **kwargs: object) -> None:
+        pytest.fail("cached bytecode wasn't used")
+
+    monkeypatch.setattr(_DeferredFileLoader, "source_to_code", _fail_source_to_code)
+
+    spec, module, _ = create_sample_module(tmp_path, source)
+    assert spec.loader
+    spec.loader.exec_module(module)
+
+    assert expected_cache.read_bytes() == regular_bytecode
+
+
+def test_pycache_not_shared_between_instrumentation_modes(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that bytecode cached for one kind of instrumentation isn't reused for the other."""
+
+    monkeypatch.setattr(sys, "dont_write_bytecode", False)
+
+    source = """\
+import defer_imports
+
+with defer_imports.until_use:
+    import asyncio
+
+import inspect
+"""
+
+    spec, module, path = create_sample_module(tmp_path, source)
+    assert spec.loader
+    spec.loader.exec_module(module)
+
+    assert module.inspect is sys.modules["inspect"]
+    assert Path(importlib.util.cache_from_source(str(path))).is_file()
+
+    spec, module, _ = create_sample_module(tmp_path, source, defer_module_level=True)
+    assert spec.loader
+    spec.loader.exec_module(module)
+
+    assert "<key for 'inspect' import>: <proxy for 'import inspect'>" in deferred_entries(vars(module))
+
+
 def test_error_if_non_import(tmp_path: Path):
     source = """\
 import defer_imports
@@ -861,6 +944,26 @@ with defer_imports.until_use:
     assert exc_info.value.text == "from typing import *"
 
 
+def test_error_if_defer_imports_rebound(tmp_path: Path):
+    source = """\
+import defer_imports
+
+with defer_imports.until_use:
+    import inspect as defer_imports
+"""
+
+    spec, module, module_path = create_sample_module(tmp_path, source)
+    assert spec.loader
+
+    with pytest.raises(SyntaxError) as exc_info:
+        spec.loader.exec_module(module)
+
+    assert exc_info.value.filename == str(module_path)
+    assert exc_info.value.lineno == 4
+    assert exc_info.value.offset == 5
+    assert exc_info.value.text == "import inspect as defer_imports"
+
+
 def test_top_level_and_submodules_1(tmp_path: Path):
     source = """\
 import defer_imports
@@ -875,31 +978,32 @@ with defer_imports.until_use:
     spec.loader.exec_module(module)
 
     # Prevent the caching of these from interfering with the test.
+    modules = sys.modules
     for mod in ("importlib", "importlib.abc", "importlib.util"):
-        sys.modules.pop(mod, None)
+        modules.pop(mod, None)
 
     expected_importlib_repr = "<key for 'importlib' import>: <proxy for 'import importlib'>"
     expected_importlib_abc_repr = "<key for 'abc' import>: <proxy for 'import importlib.abc as ...'>"
     expected_importlib_util_repr = "<key for 'util' import>: <proxy for 'import importlib.util as ...'>"
 
     # Test that the importlib proxy is here and then resolves.
-    assert expected_importlib_repr in repr(vars(module))
+    assert expected_importlib_repr in deferred_entries(vars(module))
     assert module.importlib
-    assert expected_importlib_repr not in repr(vars(module))
+    assert expected_importlib_repr not in deferred_entries(vars(module))
 
     # Test that the nested proxies carry over to the resolved importlib.
     module_importlib_vars = cast(dict[str, object], vars(module.importlib))
 
-    assert expected_importlib_abc_repr in repr(module_importlib_vars)
-    assert expected_importlib_util_repr in repr(module_importlib_vars)
+    assert expected_importlib_abc_repr in deferred_entries(module_importlib_vars)
+    assert expected_importlib_util_repr in deferred_entries(module_importlib_vars)
 
-    assert expected_importlib_abc_repr in repr(module_importlib_vars)
+    assert expected_importlib_abc_repr in deferred_entries(module_importlib_vars)
     assert module.importlib.abc
-    assert expected_importlib_abc_repr not in repr(module_importlib_vars)
+    assert expected_importlib_abc_repr not in deferred_entries(module_importlib_vars)
 
-    assert expected_importlib_util_repr in repr(module_importlib_vars)
+    assert expected_importlib_util_repr in deferred_entries(module_importlib_vars)
     assert module.importlib.util
-    assert expected_importlib_util_repr not in repr(module_importlib_vars)
+    assert expected_importlib_util_repr not in deferred_entries(module_importlib_vars)
 
 
 def test_top_level_and_submodules_2(tmp_path: Path):
@@ -945,28 +1049,28 @@ with defer_imports.until_use:
     )
 
     # Make sure the right proxies are present.
-    assert expected_asyncio_repr in repr(vars(module))
-    assert expected_asyncio_base_events_repr in repr(vars(module))
-    assert expected_asyncio_base_futures_repr in repr(vars(module))
+    assert expected_asyncio_repr in deferred_entries(vars(module))
+    assert expected_asyncio_base_events_repr in deferred_entries(vars(module))
+    assert expected_asyncio_base_futures_repr in deferred_entries(vars(module))
 
     # Make sure resolving one proxy doesn't resolve or void the others.
     assert module.base_futures
     assert module.base_futures is sys.modules["asyncio.base_futures"]
-    assert expected_asyncio_base_futures_repr not in repr(vars(module))
-    assert expected_asyncio_base_events_repr in repr(vars(module))
-    assert expected_asyncio_repr in repr(vars(module))
+    assert expected_asyncio_base_futures_repr not in deferred_entries(vars(module))
+    assert expected_asyncio_base_events_repr in deferred_entries(vars(module))
+    assert expected_asyncio_repr in deferred_entries(vars(module))
 
     assert module.base_events
     assert module.base_events is sys.modules["asyncio.base_events"]
-    assert expected_asyncio_base_events_repr not in repr(vars(module))
-    assert expected_asyncio_base_futures_repr not in repr(vars(module))
-    assert expected_asyncio_repr in repr(vars(module))
+    assert expected_asyncio_base_events_repr not in deferred_entries(vars(module))
+    assert expected_asyncio_base_futures_repr not in deferred_entries(vars(module))
+    assert expected_asyncio_repr in deferred_entries(vars(module))
 
     assert module.asyncio
     assert module.asyncio is sys.modules["asyncio"]
-    assert expected_asyncio_base_events_repr not in repr(vars(module))
-    assert expected_asyncio_base_futures_repr not in repr(vars(module))
-    assert expected_asyncio_repr not in repr(vars(module))
+    assert expected_asyncio_base_events_repr not in deferred_entries(vars(module))
+    assert expected_asyncio_base_futures_repr not in deferred_entries(vars(module))
+    assert expected_asyncio_repr not in deferred_entries(vars(module))
 
 
 def test_relative_imports(tmp_path: Path):
@@ -1028,10 +1132,10 @@ class B:
     with temp_cache_module(package_name, module):
         spec.loader.exec_module(module)
 
-        module_locals_repr = repr(vars(module))
-        assert "<key for 'a' import>: <proxy for 'from sample_pkg import a'>" in module_locals_repr
-        assert "<key for 'A' import>: <proxy for 'from sample_pkg.a import A'>" in module_locals_repr
-        assert "<key for 'B' import>: <proxy for 'from sample_pkg.b import B'>" in module_locals_repr
+        module_deferred_entries = deferred_entries(vars(module))
+        assert "<key for 'a' import>: <proxy for 'from sample_pkg import a'>" in module_deferred_entries
+        assert "<key for 'A' import>: <proxy for 'from sample_pkg.a import A'>" in module_deferred_entries
+        assert "<key for 'B' import>: <proxy for 'from sample_pkg.b import B'>" in module_deferred_entries
 
         assert module.A
         assert repr(module.A("hello")).startswith("<sample_pkg.a.A object at")
@@ -1224,13 +1328,13 @@ type ManyExpensive = tuple[Expensive, ...]
         spec.loader.exec_module(module)
         expected_proxy_repr = "<key for 'Expensive' import>: <proxy for 'from type_stmt_pkg.exp import Expensive'>"
 
-        assert expected_proxy_repr in repr(vars(module))
+        assert expected_proxy_repr in deferred_entries(vars(module))
 
         assert str(module.ManyExpensive) == "ManyExpensive"
-        assert expected_proxy_repr in repr(vars(module))
+        assert expected_proxy_repr in deferred_entries(vars(module))
 
         assert str(module.ManyExpensive.__value__) == "tuple[type_stmt_pkg.exp.Expensive, ...]"
-        assert expected_proxy_repr not in repr(vars(module))
+        assert expected_proxy_repr not in deferred_entries(vars(module))
 
 
 # endregion